@@ -28,8 +28,11 @@
 #
 # =================================================================
 
-import tempfile
+import functools
+import glob
 import logging
+import os
+import tempfile
 
 import numpy as np
 import xarray
@@ -45,6 +48,14 @@ from pygeoapi.provider.xarray_ import (XarrayProvider,
 LOGGER = logging.getLogger(__name__)
 
 DCS_VAR = ('tx', 'tm', 'tn', 'pr')
+MONTHLY_DATA = ('monthly_ens', 'SPEI')
+# storage and compression encodings not carried over to NetCDF output
+STORAGE_ENCODING = ('zlib', 'complevel', 'shuffle', 'fletcher32', 'szip',
+                    'zstd', 'bzip2', 'blosc', 'compression', 'contiguous',
+                    'chunksizes', 'chunks', 'preferred_chunks', 'compressor',
+                    'compressors', 'filters', 'serializer', 'shards',
+                    'fill_value', 'write_empty_chunks', 'source',
+                    'original_shape')
 
 
 class ClimateProvider(XarrayProvider):
@@ -59,8 +70,12 @@ class ClimateProvider(XarrayProvider):
 
         BaseProvider.__init__(self, provider_def)
 
+        self.promote_fp32 = provider_def.get('promote_fp32', False)
+
         try:
-            self._data = open_data(self.data)
+            self._data = open_data(self.data, self.promote_fp32)
+            self._var_attrs = {name: dict(var.attrs) for name, var
+                               in self._data.variables.items()}
             self._coverage_properties = self._get_coverage_properties()
 
             self.axes = [self._coverage_properties['x_axis_label'],
@@ -202,16 +217,17 @@ class ClimateProvider(XarrayProvider):
         """
 
         time_var, y_var, x_var = [None, None, None]
-        for coord in self._data.coords:
+        for coord, coord_var in self._data.coords.variables.items():
+            units = coord_var.attrs.get('units', '')
             if coord.lower() == 'time':
                 time_var = coord
-                continue
-            if self._data.coords[coord].attrs['units'] == 'degrees_north':
+            elif units == 'degrees_north':
                 y_var = coord
-                continue
-            if self._data.coords[coord].attrs['units'] == 'degrees_east':
+            elif units == 'degrees_east':
                 x_var = coord
-                continue
+
+            if None not in (time_var, x_var, y_var):
+                break
 
         if self.x_field is None:
             self.x_field = x_var
@@ -220,13 +236,22 @@ class ClimateProvider(XarrayProvider):
         if self.time_field is None:
             self.time_field = time_var
 
+        self._axis_keys = frozenset((self.x_field, self.y_field,
+                                     self.time_field))
+
+        # numpy datetime unit used by _to_datetime_string
+        if any(month in self.data for month in MONTHLY_DATA):
+            self._time_unit = 'M'
+        else:
+            self._time_unit = 'Y'
+
+        x_first, x_last = self._data.coords[self.x_field].values[[0, -1]]
+        y_first, y_last = self._data.coords[self.y_field].values[[0, -1]]
+        width = self._data.dims[self.x_field]
+        height = self._data.dims[self.y_field]
+
         properties = {
-            'bbox': [
-                self._data.coords[self.x_field].values[0],
-                self._data.coords[self.y_field].values[0],
-                self._data.coords[self.x_field].values[-1],
-                self._data.coords[self.y_field].values[-1],
-            ],
+            'bbox': [x_first, y_first, x_last, y_last],
             'time_range': [0, 0],
             'restime': 0,
             'time_axis_label': self.time_field,
@@ -234,13 +259,13 @@ class ClimateProvider(XarrayProvider):
             'crs_type': 'GeographicCRS',
             'x_axis_label': self.x_field,
             'y_axis_label': self.y_field,
-            'width': self._data.dims[self.x_field],
-            'height': self._data.dims[self.y_field],
+            'axes': [self.x_field, self.y_field],
+            'width': width,
+            'height': height,
             'bbox_units': 'degrees',
-            'resx': np.abs(self._data.coords[self.x_field].values[1]
-                           - self._data.coords[self.x_field].values[0]),
-            'resy': np.abs(self._data.coords[self.y_field].values[1]
-                           - self._data.coords[self.y_field].values[0]),
+            # uniform grid spacing, 0 for single cell axes
+            'resx': np.abs(x_last - x_first) / max(width - 1, 1),
+            'resy': np.abs(y_last - y_first) / max(height - 1, 1),
         }
 
         if 'crs' in self._data.variables.keys():
@@ -253,27 +278,18 @@ class ClimateProvider(XarrayProvider):
 
             properties['crs_type'] = 'ProjectedCRS'
 
-        properties['axes'] = [
-            properties['x_axis_label'],
-            properties['y_axis_label']
-        ]
-
         if 'avg_20years' not in self.data:
-            properties['axes'].append(properties['time_axis_label'])
+            properties['axes'].append(self.time_field)
             properties['time_duration'] = self.get_time_coverage_duration()
             properties['restime'] = self.get_time_resolution()
-            properties['time_range'] = [
-                self._to_datetime_string(
-                    self._data.coords[self.time_field].values[0]
-                ),
-                self._to_datetime_string(
-                    self._data.coords[self.time_field].values[-1]
-                )
-            ]
+            properties['time_range'] = self._to_datetime_string(
+                self._data.coords[self.time_field].values[[0, -1]]
+            )
             properties['time'] = self._data.dims[self.time_field]
 
-        properties['fields'] = [name for name in self._data.variables
-                                if len(self._data.variables[name].shape) >= 3]
+        properties['fields'] = [name for name, var
+                                in self._data.variables.items()
+                                if var.ndim >= 3]
         if 'dcs' in self.data:
             properties['fields'].extend(('tx', 'tm', 'tn', 'pr'))
 
@@ -286,37 +302,26 @@ class ClimateProvider(XarrayProvider):
         """
 
         if self._data[self.time_field].size > 1:
-
-            self.monthly_data = ['monthly_ens', 'SPEI']
-
-            if any(month in self.data for month in self.monthly_data):
-                period = 'month'
-            else:
-                period = 'year'
-
+            period = 'month' if self._time_unit == 'M' else 'year'
             return {'value': 1, 'period': period}
-
         else:
             return None
 
     def _to_datetime_string(self, datetime_):
         """
-        Convenience function to formulate string from various datetime objects
+        Convenience function to formulate string from datetime64 values
 
-        :param datetime_obj: datetime object (native datetime, cftime)
+        :param datetime_: numpy datetime64 value or array of values
 
-        :returns: str representation of datetime
+        :returns: str representation of datetime, or `list` of str
+                  representations when an array is passed
         """
 
         try:
-            if any(month in self.data for month in self.monthly_data):
-                month = datetime_.astype('datetime64[M]').astype(int) % 12 + 1
-                year = datetime_.astype('datetime64[Y]').astype(int) + 1970
-                value = '{}-{}'.format(year, str(month).zfill(2))
-            else:
-                value = datetime_.astype('datetime64[Y]').astype(int) + 1970
-                value = str(value)
-            return value
+            value = np.datetime_as_string(
+                np.asarray(datetime_, dtype='datetime64[ns]'),
+                unit=self._time_unit)
+            return value.tolist()
         except Exception as err:
             LOGGER.error(err)
 
@@ -334,6 +339,14 @@ class ClimateProvider(XarrayProvider):
         :returns: coverage data as dict of CoverageJSON or native format
         """
 
+        x_label = self._coverage_properties['x_axis_label']
+        y_label = self._coverage_properties['y_axis_label']
+        t_label = self._coverage_properties['time_axis_label']
+
+        # path of the requested scenario/percentile/season variant, kept
+        # local so that the provider itself is not modified by a query
+        data_path = self.data
+
         if 'scenario' in subsets:
             scenario = subsets['scenario']
             try:
@@ -343,7 +356,7 @@ class ClimateProvider(XarrayProvider):
                     raise ProviderQueryError(msg)
                 elif scenario[0] not in ['RCP2.6', 'hist']:
                     scenario_value = scenario[0].replace('RCP', '')
-                    self.data = self.data.replace('2.6', scenario_value)
+                    data_path = data_path.replace('2.6', scenario_value)
             except Exception as err:
                 LOGGER.error(err)
                 raise ProviderQueryError(err)
@@ -356,7 +369,7 @@ class ClimateProvider(XarrayProvider):
             try:
                 if percentile != [50]:
                     pctl = str(percentile[0])
-                    self.data = self.data.replace('pctl50',
+                    data_path = data_path.replace('pctl50',
                                                   'pctl{}'.format(pctl))
 
             except Exception as err:
@@ -374,7 +387,7 @@ class ClimateProvider(XarrayProvider):
                     LOGGER.error(msg)
                     raise ProviderQueryError(msg)
                 elif years_avg[0] not in ['2021-2040']:
-                    self.data = self.data.replace('2021-2040', years_avg[0])
+                    data_path = data_path.replace('2021-2040', years_avg[0])
             except Exception as err:
                 LOGGER.error(err)
                 raise ProviderQueryError(err)
@@ -391,7 +404,7 @@ class ClimateProvider(XarrayProvider):
                     raise ProviderQueryError(msg)
                 elif seasonal != ['DJF']:
                     season = str(seasonal[0])
-                    self.data = self.data.replace('DJF',
+                    data_path = data_path.replace('DJF',
                                                   season)
 
             except Exception as err:
@@ -400,20 +413,20 @@ class ClimateProvider(XarrayProvider):
 
             subsets.pop('season')
 
-        self._data = open_data(self.data)
+        ds = open_data(data_path, self.promote_fp32)
 
         # set default variable if range_subset is None
         range_subset_ = range_subset.copy()
 
         if not range_subset:
-            name = list(self._data.variables.keys())[-1]
+            name = list(ds.variables.keys())[-1]
             range_subset_.append(name)
         elif 'dcs' in self.data:
             dcs_range_subset = []
             if 'monthly' not in self.data:
                 for v in range_subset_:
                     dcs_range_subset.append(next(k for k in list(
-                        self._data.variables.keys()) if v in k))
+                        ds.variables.keys()) if v in k))
             else:
                 dcs = {'pr': 'pr', 'tx': 'tasmax',
                        'tm': 'tmean', 'tn': 'tasmin'}
@@ -435,60 +448,60 @@ class ClimateProvider(XarrayProvider):
                              'snd': 'SNDPT',
                              'tas': 'TEMP'}
                 _var = cmip5_var[range_subset_[0]]
-                cmip5_file = self.data.replace('*', _var)
+                cmip5_file = data_path.replace('*', _var)
             except KeyError as err:
                 LOGGER.error(err)
                 msg = 'Not a validd range-subset value'
                 raise ProviderQueryError(msg)
-            data = xarray.open_dataset(cmip5_file)
+            data = open_data(cmip5_file,
+                             self.promote_fp32).copy(deep=False)
         else:
-            data = self._data[[*range_subset_]]
+            data = ds[[*range_subset_]]
+
+        if format_ == 'json':
+            # CoverageJSON only uses the grid axes, so auxiliary
+            # coordinates are dropped before subsetting
+            data = data.drop_vars([
+                name for name in data.coords
+                if name not in data.dims
+                and name not in (x_label, y_label, t_label)
+            ])
+
+        needs_subset = (bool(bbox) or datetime_ is not None
+                        or not self._axis_keys.isdisjoint(subsets))
 
-        if any([self._coverage_properties['x_axis_label'] in subsets,
-                self._coverage_properties['y_axis_label'] in subsets,
-                self._coverage_properties['time_axis_label'] in subsets,
-                bbox,
-                datetime_ is not None]):
+        if needs_subset:
 
             LOGGER.debug('Creating spatio-temporal subset')
 
-            query_params = {}
-            for key, val in subsets.items():
-                if data.coords[key].values[0] > data.coords[key].values[-1]:
-                    LOGGER.debug('Reversing slicing low/high')
-                    query_params[key] = slice(val[1], val[0])
-                else:
-                    query_params[key] = slice(val[0], val[1])
+            # axis direction is read from the queried data, variants and
+            # CMIP5 files carry their own indexes
+            query_params = {
+                key: slice(val[1], val[0])
+                if key in data.indexes and _is_descending(data.indexes[key])
+                else slice(val[0], val[1])
+                for key, val in subsets.items()
+            }
 
             if bbox:
-                if all([self._coverage_properties['x_axis_label'] in subsets,
-                        self._coverage_properties['y_axis_label'] in subsets,
-                        len(bbox) > 0]):
+                if x_label in subsets and y_label in subsets:
                     msg = 'bbox and subsetting by coordinates are exclusive'
                     LOGGER.warning(msg)
                     raise ProviderQueryError(msg)
                 else:
-                    query_params[self._coverage_properties['x_axis_label']] = \
-                        slice(bbox[0], bbox[2])
+                    query_params[x_label] = slice(bbox[0], bbox[2])
 
-                    self._coverage_properties['time_axis_label']
-
-                    lat = self._data.coords[self.y_field]
-                    lat_field = self._coverage_properties['y_axis_label']
-
-                    if lat.values[1] > lat.values[0]:
-                        query_params[lat_field] = \
-                            slice(bbox[1], bbox[3])
+                    if _is_descending(data.indexes[y_label]):
+                        query_params[y_label] = slice(bbox[3], bbox[1])
                     else:
-                        query_params[lat_field] = \
-                            slice(bbox[3], bbox[1])
+                        query_params[y_label] = slice(bbox[1], bbox[3])
 
             if datetime_ is not None:
                 if 'avg_20years' in self.data:
                     msg = 'datetime not suported for 20 years average layers'
                     LOGGER.error(msg)
                     raise ProviderQueryError(msg)
-                elif self._coverage_properties['time_axis_label'] in subsets:
+                elif t_label in subsets:
                     msg = 'datetime and temporal subsetting are exclusive'
                     LOGGER.error(msg)
                 else:
@@ -497,57 +510,77 @@ class ClimateProvider(XarrayProvider):
                         begin, end = datetime_.split('/')
 
                         if begin < end:
-                            query_params[self.time_field] = slice(begin, end)
+                            query_params[t_label] = slice(begin, end)
                         else:
                             LOGGER.debug('Reversing slicing from high to low')
-                            query_params[self.time_field] = slice(end, begin)
+                            query_params[t_label] = slice(end, begin)
                     else:
-                        query_params[self.time_field] = datetime_
+                        query_params[t_label] = slice(datetime_, datetime_)
 
             LOGGER.debug('Query parameters: {}'.format(query_params))
             try:
-                data = data.loc[query_params]
+                # resolve label slices to positional slices so the whole
+                # spatio-temporal subset is done in a single isel call
+                isel_params = {
+                    key: data.indexes[key].slice_indexer(val.start, val.stop)
+                    for key, val in query_params.items()
+                }
+                data = data.isel(isel_params)
             except Exception as err:
                 LOGGER.warning(err)
                 raise ProviderQueryError(err)
 
-        if (any([data.coords[self.x_field].size == 0,
-                data.coords[self.y_field].size == 0])):
+        x_index = data.indexes[x_label]
+        y_index = data.indexes[y_label]
+
+        no_data = x_index.size == 0 or y_index.size == 0
+        if 'avg_20years' not in self.data:
+            no_data = no_data or data.indexes[t_label].size == 0
+
+        if no_data:
             msg = 'No data found'
             LOGGER.warning(msg)
             raise ProviderNoDataError(msg)
 
+        # the attribute snapshot only describes the provider's own dataset,
+        # scenario/percentile/season variants are read from their own files
+        if data_path == self.data:
+            variables = {
+                var_name: self._var_attrs[var_name]
+                if var_name in self._var_attrs
+                else data.variables[var_name].attrs
+                for var_name in data.variables
+            }
+        else:
+            variables = {var_name: var.attrs
+                         for var_name, var in data.variables.items()}
+
         out_meta = {
-            'bbox': [
-                data.coords[self.x_field].values[0],
-                data.coords[self.y_field].values[0],
-                data.coords[self.x_field].values[-1],
-                data.coords[self.y_field].values[-1]
-            ],
+            'bbox': [x_index[0], y_index[0], x_index[-1], y_index[-1]],
             'time': [None, None],
             "driver": "xarray",
-            "height": data.dims[self.y_field],
-            "width": data.dims[self.x_field],
+            "height": data.dims[y_label],
+            "width": data.dims[x_label],
             "time_steps": 1,
-            "variables": {var_name: var.attrs
-                          for var_name, var in data.variables.items()}
+            "variables": variables
         }
 
         if 'avg_20years' not in self.data:
-            out_meta["time"] = [
-                self._to_datetime_string(
-                    data.coords[self.time_field].values[0]),
-                self._to_datetime_string(
-                    data.coords[self.time_field].values[-1])
-            ]
-            out_meta['time_steps'] = data.dims[self.time_field]
+            out_meta["time"] = self._to_datetime_string(
+                data.indexes[t_label].values[[0, -1]])
+            out_meta['time_steps'] = data.dims[t_label]
 
         LOGGER.debug('Serializing data in memory')
         if format_ == 'json':
             LOGGER.debug('Creating output in CoverageJSON')
+            data = _convert_float32_to_float64(data)
             return self.gen_covjson(out_meta, data, range_subset_)
         elif format_ == 'zarr':
             LOGGER.debug('Returning data in native zarr format')
+            # pygeoapi sends the returned bytes as the response body, so
+            # the zipped store cannot be streamed; to_zarr only writes
+            # chunk by chunk for dask backed data (Zarr, multi-file or
+            # promote_fp32), otherwise each variable is loaded first
             return _get_zarr_data(data)
         # elif format_.lower() == 'geotiff':
         #     if len(range_subset) == 1:
@@ -565,26 +598,87 @@ class ClimateProvider(XarrayProvider):
         #         raise ProviderQueryError(err)
 
         else:  # return data in native format
-            with tempfile.TemporaryFile() as fp:
-                LOGGER.debug('Returning data in native NetCDF format')
-                fp.write(data.to_netcdf())
-                fp.seek(0)
-                return fp.read()
+            LOGGER.debug('Returning data in native NetCDF format')
+            return _get_netcdf_data(data)
 
 
-def open_data(data):
+@functools.lru_cache(maxsize=32)
+def open_data(data, promote_fp32=False):
     """
-    Convenience function to open multiple files with xarray
-    :param data: path to files
+    Convenience function to open one or multiple files with xarray
+    Opened datasets are cached by path for the lifetime of the process
+    and shared between all providers and requests, so they must not be
+    modified or closed by callers.
+
+    :param data: path to file(s), may contain glob wildcards, or
+                 `tuple` of paths
+    :param promote_fp32: whether to convert float32 variables to float64
 
     :returns: xarray dataset
     """
 
     try:
-        open_func = xarray.open_mfdataset
-        _data = open_func(data)
-        _data = _convert_float32_to_float64(_data)
+        if isinstance(data, str) and not glob.has_magic(data):
+            LOGGER.debug('Opening single dataset {}'.format(data))
+            if data.endswith('.zarr'):
+                # keep the on-disk chunking, reads stay lazy through dask
+                _data = xarray.open_dataset(data, engine='zarr', chunks={})
+            elif promote_fp32:
+                # dask backed, so that the float64 promotion stays lazy
+                _data = xarray.open_dataset(data, chunks={})
+            else:
+                _data = xarray.open_dataset(data)
+        else:
+            LOGGER.debug('Opening multiple datasets {}'.format(data))
+            _data = xarray.open_mfdataset(data, parallel=True,
+                                          combine='by_coords', chunks={},
+                                          data_vars='minimal',
+                                          coords='minimal',
+                                          compat='override')
+        if promote_fp32:
+            _data = _convert_float32_to_float64(_data)
 
         return _data
     except Exception as err:
         LOGGER.error(err)
+        raise ProviderConnectionError(err)
+
+
+def _is_descending(index):
+    """
+    Helper function to detect a coordinate stored from high to low values
+
+    :param index: pandas index of a coordinate
+
+    :returns: `bool` of whether the index is in descending order
+    """
+
+    return len(index) > 1 and index.is_monotonic_decreasing
+
+
+def _get_netcdf_data(data):
+    """
+    Returns bytes of dataset serialized to NetCDF
+    The dataset is written straight to a temporary file, without
+    compression, rather than being built in memory first. The source
+    encoding (packing, missing values, time units) is kept, minus its
+    storage and compression settings.
+
+    :param data: Xarray dataset of coverage data
+
+    :returns: byte array of NetCDF data
+    """
+
+    encoding = {}
+    for name in data.data_vars:
+        encoding[name] = {key: value for key, value
+                          in data.variables[name].encoding.items()
+                          if key not in STORAGE_ENCODING}
+        encoding[name]['zlib'] = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'data.nc')
+        data.to_netcdf(filename, encoding=encoding)
+
+        with open(filename, 'rb') as fh:
+            return fh.read()
@@ -28,7 +28,6 @@
 #
 # =================================================================
 
-import tempfile
 import logging
 
 from pygeoapi.provider.base import (BaseProvider,
@@ -36,8 +35,10 @@ from pygeoapi.provider.base import (BaseProvider,
                                     ProviderNoDataError,
                                     ProviderQueryError)
 from msc_pygeoapi.provider.climate_xarray import (ClimateProvider,
+                                                  _get_netcdf_data,
                                                   open_data)
-from pygeoapi.provider.xarray_ import (_get_zarr_data)
+from pygeoapi.provider.xarray_ import (_convert_float32_to_float64,
+                                       _get_zarr_data)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -54,8 +55,10 @@ class SPEIProvider(ClimateProvider):
 
         BaseProvider.__init__(self, provider_def)
 
+        self.promote_fp32 = provider_def.get('promote_fp32', False)
+
         try:
-            self._data = open_data(self.data)
+            self._data = open_data(self.data, self.promote_fp32)
             self._coverage_properties = self._get_coverage_properties()
 
             self.axes = [self._coverage_properties['x_axis_label'],
@@ -104,6 +107,10 @@ class SPEIProvider(ClimateProvider):
         :returns: coverage data as dict of CoverageJSON or native format
         """
 
+        # path of the requested scenario/percentile variant, kept local
+        # so that the provider itself is not modified by a query
+        data_path = self.data
+
         if 'scenario' in subsets:
             scenario = subsets['scenario']
             try:
@@ -113,7 +120,7 @@ class SPEIProvider(ClimateProvider):
                     raise ProviderQueryError(msg)
                 elif scenario[0] not in ['RCP2.6', 'hist']:
                     scenario_value = scenario[0].replace('RCP', '')
-                    self.data = self.data.replace('2.6', scenario_value)
+                    data_path = data_path.replace('2.6', scenario_value)
             except Exception as err:
                 LOGGER.error(err)
                 raise ProviderQueryError(err)
@@ -126,7 +133,7 @@ class SPEIProvider(ClimateProvider):
             try:
                 if percentile != [50]:
                     pctl = str(percentile[0])
-                    self.data = self.data.replace('pctl50',
+                    data_path = data_path.replace('pctl50',
                                                   'pctl{}'.format(pctl))
 
             except Exception as err:
@@ -135,9 +142,9 @@ class SPEIProvider(ClimateProvider):
 
             subsets.pop('percentile')
 
-        self._data = open_data(self.data)
+        ds = open_data(data_path, self.promote_fp32)
 
-        data = self._data[[*range_subset]]
+        data = ds[[*range_subset]]
 
         if any([self._coverage_properties['x_axis_label'] in subsets,
                 self._coverage_properties['y_axis_label'] in subsets,
@@ -149,8 +156,8 @@ class SPEIProvider(ClimateProvider):
 
             query_params = {}
             for key, val in subsets.items():
-                val_0 = self._data.coords[key].values[0]
-                val_1 = self._data.coords[key].values[-1]
+                val_0 = ds.coords[key].values[0]
+                val_1 = ds.coords[key].values[-1]
                 if val_0 > val_1:
                     LOGGER.debug('Reversing slicing low/high')
                     query_params[key] = slice(val[1], val[0])
@@ -189,7 +196,7 @@ class SPEIProvider(ClimateProvider):
 
             LOGGER.debug('Query parameters: {}'.format(query_params))
             try:
-                data = self._data.loc[query_params]
+                data = ds.loc[query_params]
             except Exception as err:
                 LOGGER.warning(err)
                 raise ProviderQueryError(err)
@@ -224,13 +231,11 @@ class SPEIProvider(ClimateProvider):
         LOGGER.debug('Serializing data in memory')
         if format_ == 'json':
             LOGGER.debug('Creating output in CoverageJSON')
+            data = _convert_float32_to_float64(data)
             return self.gen_covjson(out_meta, data, range_subset)
         elif format_ == 'zarr':
             LOGGER.debug('Returning data in native zarr format')
             return _get_zarr_data(data)
         else:  # return data in native format
-            with tempfile.TemporaryFile() as fp:
-                LOGGER.debug('Returning data in native NetCDF format')
-                fp.write(data.to_netcdf())
-                fp.seek(0)
-                return fp.read()
+            LOGGER.debug('Returning data in native NetCDF format')
+            return _get_netcdf_data(data)
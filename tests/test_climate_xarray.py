@@ -0,0 +1,136 @@
+# =================================================================
+#
+# Author: agent <agent@local>
+#
+# Copyright (c) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# =================================================================
+
+import numpy as np
+import xarray
+
+from msc_pygeoapi.provider.climate_xarray import (ClimateProvider,
+                                                  _get_netcdf_data)
+
+
+def test_get_netcdf_data(tmp_path):
+    """Test NetCDF output keeps the source packing without compression"""
+
+    src = tmp_path / 'packed.nc'
+    values = np.linspace(250, 300, 180 * 360).reshape((180, 360))
+    xarray.Dataset(
+        {'tas': (('lat', 'lon'), values)},
+        coords={'lat': np.arange(89.5, -90, -1.0),
+                'lon': np.arange(-179.5, 180, 1.0)}
+    ).to_netcdf(src, encoding={'tas': {'dtype': 'int16',
+                                       'scale_factor': 0.01,
+                                       'add_offset': 275.0,
+                                       '_FillValue': -32767,
+                                       'zlib': True}})
+
+    with xarray.open_dataset(src) as data:
+        subset = data.isel(lat=slice(0, 10), lon=slice(0, 10))
+
+        out = tmp_path / 'out.nc'
+        out.write_bytes(_get_netcdf_data(subset))
+
+    with xarray.open_dataset(out) as result:
+        encoding = result['tas'].encoding
+        assert encoding['dtype'] == np.dtype('int16')
+        assert encoding['scale_factor'] == 0.01
+        assert encoding['add_offset'] == 275.0
+        assert encoding['_FillValue'] == -32767
+        assert not encoding.get('zlib', False)
+        np.testing.assert_allclose(result['tas'].values,
+                                   values[:10, :10], atol=0.01)
+
+
+def test_get_netcdf_data_missing_value(tmp_path):
+    """Test NetCDF output keeps missing_value and datetime encodings"""
+
+    src = tmp_path / 'missing.nc'
+    values = np.arange(20, dtype='float64').reshape((4, 5))
+    values[0, 0] = np.nan
+    xarray.Dataset(
+        {'tas': (('lat', 'lon'), values),
+         'date': ((), np.datetime64('2021-01-01'))},
+        coords={'lat': np.arange(4.0), 'lon': np.arange(5.0)}
+    ).to_netcdf(src, encoding={'tas': {'dtype': 'int16',
+                                       'missing_value': -999,
+                                       '_FillValue': None,
+                                       'zlib': True},
+                               'date': {'units': 'days since 2000-01-01',
+                                        'calendar': 'noleap'}})
+
+    with xarray.open_dataset(src) as data:
+        out = tmp_path / 'out.nc'
+        out.write_bytes(_get_netcdf_data(data))
+
+    with xarray.open_dataset(out) as result:
+        encoding = result['tas'].encoding
+        assert encoding['dtype'] == np.dtype('int16')
+        assert encoding['missing_value'] == -999
+        assert not encoding.get('zlib', False)
+        np.testing.assert_array_equal(result['tas'].values, values)
+
+        assert result['date'].encoding['units'] == 'days since 2000-01-01'
+        assert result['date'].encoding['calendar'] == 'noleap'
+
+
+def test_query_scenario(tmp_path):
+    """Test scenario queries leave the provider's own dataset untouched"""
+
+    for scenario, value in (('2.6', 1.0), ('8.5', 8.0)):
+        directory = tmp_path / 'RCP{}'.format(scenario)
+        directory.mkdir()
+        xarray.Dataset(
+            {'tas': (('time', 'lat', 'lon'), np.full((3, 4, 5), value))},
+            coords={'time': np.array(['2021', '2022', '2023'],
+                                     dtype='datetime64[ns]'),
+                    'lat': ('lat', np.arange(4.0),
+                            {'units': 'degrees_north'}),
+                    'lon': ('lon', np.arange(5.0),
+                            {'units': 'degrees_east'})}
+        ).to_netcdf(directory / 'tas_rcp{}.nc'.format(scenario))
+
+    data = str(tmp_path / 'RCP2.6' / 'tas_rcp2.6.nc')
+    provider = ClimateProvider({'name': 'climate', 'type': 'coverage',
+                                'data': data, 'x_field': 'lon',
+                                'y_field': 'lat', 'time_field': 'time'})
+    dataset = provider._data
+
+    out = tmp_path / 'out.nc'
+    out.write_bytes(provider.query(range_subset=['tas'],
+                                   subsets={'scenario': ['RCP8.5']},
+                                   format_='NetCDF'))
+    with xarray.open_dataset(out) as result:
+        assert (result['tas'].values == 8.0).all()
+
+    assert provider.data == data
+    assert provider._data is dataset
+    assert (provider._data['tas'].values == 1.0).all()
+
+    out.write_bytes(provider.query(range_subset=['tas'], format_='NetCDF'))
+    with xarray.open_dataset(out) as result:
+        assert (result['tas'].values == 1.0).all()